@@ -0,0 +1,162 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from neural_network import NeuralNetwork
+from utils import ACTIONS, action_to_index
+
+GOAL_SPACE_NAMES = ['agent', 'pickaxe', 'shovel', 'cart', 'blocks']
+GOAL_DIM = len(GOAL_SPACE_NAMES) + 5  # One-hot goal space + goal vector padded to the widest space (blocks)
+OBSERVATION_DIM = 18
+
+TOP_K = 5  # Best experiences per goal used as demonstrations
+EPOCHS = 50
+BATCH_SIZE = 256
+LEARNING_RATE = 1e-3
+HIDDEN_DIM = 64
+DISTILLED_PATH = "distilled_policy.pt"
+PLACEHOLDER_PARAM_KEY = 1  # Trajectories get the initial parameters' key (never dropped), so they fit the knowledge base
+
+# ------ Goal conditioning ------
+
+def encode_goal(goal_space_name, goal):
+    encoding = np.zeros(GOAL_DIM, dtype=np.float32)
+    encoding[GOAL_SPACE_NAMES.index(goal_space_name)] = 1
+    goal = np.atleast_1d(np.asarray(goal, dtype=np.float32))
+    encoding[len(GOAL_SPACE_NAMES):len(GOAL_SPACE_NAMES) + len(goal)] = goal
+    return encoding
+
+# ------ Dataset from the knowledge base ------
+
+# For every goal of every goal space, the top-k experiences by final
+# observation fitness become demonstrations: each step maps
+# (observation, goal encoding) -> the action taken.
+
+def collect_dataset(knowledge_base, goal_space_manager, top_k=TOP_K):
+    experiences = list(knowledge_base.experiences)
+    if not experiences:
+        raise ValueError("Knowledge base is empty, nothing to distill")
+    final_observations = np.array([exp.final_observation for exp in experiences], dtype=np.float32)
+
+    inputs, targets = [], []
+    for name, goal_space in goal_space_manager.goal_spaces.items():
+        goals = list(goal_space.goals.values())
+        fitness = goal_space.get_fitness_batch(final_observations, goals)
+        for g, goal in enumerate(goals):
+            goal_encoding = encode_goal(name, goal)
+            for i in np.argsort(-fitness[:, g], kind='stable')[:top_k]:
+                if fitness[i, g] <= 0:
+                    break
+                for step in experiences[i].trajectory:
+                    inputs.append(np.concatenate([np.asarray(step[:18], dtype=np.float32), goal_encoding]))
+                    targets.append(action_to_index(step[18:21]))
+
+    if not inputs:
+        raise ValueError("No experience reaches any goal with positive fitness")
+    return torch.tensor(np.array(inputs)), torch.tensor(targets, dtype=torch.long)
+
+# ------ Training ------
+
+def distill(knowledge_base, goal_space_manager, top_k=TOP_K, epochs=EPOCHS, batch_size=BATCH_SIZE,
+            learning_rate=LEARNING_RATE, hidden_dim=HIDDEN_DIM, verbose=True):
+    inputs, targets = collect_dataset(knowledge_base, goal_space_manager, top_k)
+    network = NeuralNetwork(input_dim=OBSERVATION_DIM + GOAL_DIM, hidden_dim=hidden_dim, output_dim=len(ACTIONS))
+    optimizer = torch.optim.Adam(network.parameters(), lr=learning_rate)
+
+    for epoch in range(epochs):
+        permutation = torch.randperm(len(inputs))
+        total_loss = 0.0
+        for start in range(0, len(inputs), batch_size):
+            batch = permutation[start:start + batch_size]
+            action_probs = network(inputs[batch])
+            # The network ends in softmax, so train on the log of its output
+            loss = F.nll_loss(torch.log(action_probs + 1e-8), targets[batch])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(batch)
+        if verbose and (epoch % 10 == 0 or epoch == epochs - 1):
+            print(f"Epoch {epoch} | loss {total_loss / len(inputs):.4f} | {len(inputs)} demonstration steps")
+
+    return DistilledPolicy(network)
+
+# ------ Serving: one forward pass per step, no archive lookups ------
+
+class DistilledPolicy:
+    def __init__(self, network):
+        self.nn = network
+        self.nn.eval()
+
+    def save(self, path=DISTILLED_PATH):
+        torch.save({
+            'state_dict': self.nn.state_dict(),
+            'input_dim': self.nn.fc1.in_features,
+            'hidden_dim': self.nn.fc1.out_features,
+            'goal_space_names': GOAL_SPACE_NAMES,
+        }, path)
+
+    @classmethod
+    def load(cls, path=DISTILLED_PATH):
+        artifact = torch.load(path)
+        network = NeuralNetwork(input_dim=artifact['input_dim'], hidden_dim=artifact['hidden_dim'], output_dim=len(ACTIONS))
+        network.load_state_dict(artifact['state_dict'])
+        return cls(network)
+
+    def select_actions(self, observations, goal_encodings, valid_masks=None, greedy=True):
+        with torch.no_grad():
+            inputs = torch.tensor(np.concatenate([observations, goal_encodings], axis=1), dtype=torch.float32)
+            action_probs = self.nn(inputs)
+            if valid_masks is not None:
+                # Rows with no valid action at all keep their unmasked distribution
+                valid_masks = np.asarray(valid_masks) | ~np.asarray(valid_masks).any(axis=1, keepdims=True)
+                valid = torch.as_tensor(valid_masks, dtype=torch.float32)
+                action_probs = action_probs * valid
+                underflowed = action_probs.sum(dim=1) == 0
+                action_probs[underflowed] = valid[underflowed]
+            if greedy:
+                return action_probs.argmax(dim=1).numpy()
+            return torch.multinomial(action_probs, 1).squeeze(1).numpy()
+
+    def select_action(self, observation, goal_space_name, goal, valid_mask=None, greedy=True):
+        action_index = self.select_actions(np.asarray(observation, dtype=np.float32)[None],
+                                           encode_goal(goal_space_name, goal)[None],
+                                           None if valid_mask is None else np.asarray(valid_mask)[None], greedy)[0]
+        return np.array(ACTIONS[action_index])
+
+    def execute(self, env, goal_space, goal, relevant_experience=None):
+        trajectory = []
+        observation = env.observation()
+        for _ in range(env.maxSteps):
+            action = self.select_action(observation, goal_space.name, goal, env.valid_action_mask())
+            next_observation, done = env.step(action[0], action[1], action[2], render=False)
+            trajectory.append(tuple(observation) + tuple(action) + (PLACEHOLDER_PARAM_KEY,))
+            observation = next_observation
+            if done:
+                break
+        return trajectory, observation
+
+def evaluate(policy, env, goal_space_manager):
+    # Every goal starts from the same state; diamonds broken while chasing
+    # one goal would otherwise persist into the next
+    start_state = env.get_state()
+    results = {}
+    for name, goal_space in goal_space_manager.goal_spaces.items():
+        for goal in goal_space.goals.values():
+            env.set_state(start_state)
+            env.stepCount = 0
+            _, final_observation = policy.execute(env, goal_space, goal)
+            results[(name, str(goal))] = goal_space.get_fitness(final_observation, goal)
+    return results
+
+def main():
+    from main import run
+    stats, components = run({'headless': True}, verbose=False)
+    policy = distill(components['knowledge_base'], components['goal_space_manager'])
+    policy.save()
+
+    print("\nDistilled policy fitness per goal:")
+    for (name, goal), fitness in evaluate(policy, components['env'], components['goal_space_manager']).items():
+        print(f"{name} {goal}: {fitness:.4f}")
+    print(f"\nSaved to {DISTILLED_PATH}")
+
+if __name__ == "__main__":
+    main()
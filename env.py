@@ -2,43 +2,45 @@ import numpy as np
 import pygame
 import sys
 
-class MinecraftCartEnv:
+MAP_PATH = "map_340_460.png"
+MAP_WIDTH, MAP_HEIGHT = 340, 460
+TILE_SIZE = 20
 
-# ------ Initialise game, load images and set starting state ------
+# Tile offset of each movement action, in the order of utils.ACTIONS
+# (forward, backward, left, right). move == -1 steps down the map.
+MOVE_OFFSETS = [(0, TILE_SIZE), (0, -TILE_SIZE), (-TILE_SIZE, 0), (TILE_SIZE, 0)]
 
-    def __init__(self):
-        # Initialize Pygame
-        pygame.init()
+# ------ Compile the map image into a tile colour lookup ------
 
-        # Set up the display
-        self.mapWidth, self.mapHeight = 340, 460
-        self.windWidth, self.windHeight = self.mapWidth, self.mapHeight
-        self.screen = pygame.display.set_mode((self.mapWidth, self.mapHeight))
-        pygame.display.set_caption("Map Navigation Game")
+# All game logic only ever reads the colour at tile origins, so the map is
+# compiled once into a plain dict {(x, y): (r, g, b)}. The dict is picklable,
+# which lets many headless envs (e.g. sweep workers) share one compiled map.
 
-        # Load and scale the map
-        self.map = pygame.transform.scale(pygame.image.load("map_340_460.png"), (self.mapWidth, self.mapHeight))
+def compile_map(path=MAP_PATH, width=MAP_WIDTH, height=MAP_HEIGHT):
+    surface = pygame.transform.scale(pygame.image.load(path), (width, height))
+    return {(x, y): tuple(surface.get_at((x, y))[:3])
+            for y in range(0, height, TILE_SIZE)
+            for x in range(0, width, TILE_SIZE)}
 
-        # Load and scale the images
-        self.agentImg = pygame.transform.scale(pygame.image.load("agent.png"), (20, 20))
-        self.diamondBlockImg = pygame.transform.scale(pygame.image.load("diamondBlock.png"), (20, 20))
-        self.trackImg = pygame.transform.scale(pygame.image.load("track.png"), (20, 20))
-        self.distractorsImg = pygame.transform.scale(pygame.image.load("distractor.png"), (20, 20))
-        self.floorImg = pygame.transform.scale(pygame.image.load("floor.png"), (20, 20))
-        self.pickaxeImg = pygame.transform.scale(pygame.image.load("pickaxe.png"), (20, 20))
-        self.cartImg = pygame.transform.scale(pygame.image.load("cart.png"), (20, 20))
-        self.spadeImg = pygame.transform.scale(pygame.image.load("spade.png"), (20, 20))
+class MinecraftCartEnv:
 
-        # Remove black backgrounds
-        self.agentImg.set_colorkey((0, 0, 0))
-        self.pickaxeImg.set_colorkey((0, 0, 0))
-        self.spadeImg.set_colorkey((0, 0, 0))
+# ------ Initialise game, load images and set starting state ------
+
+    def __init__(self, tiles=None, headless=False):
+        self.mapWidth, self.mapHeight = MAP_WIDTH, MAP_HEIGHT
+        self.windWidth, self.windHeight = self.mapWidth, self.mapHeight
+        self.headless = headless
+        self.tiles = tiles if tiles is not None else compile_map()
+
+        # Headless envs never open a window or load sprites
+        if not self.headless:
+            self.init_display()
 
         # Find starting position (pink tile)
         self.startPos = self.find_start()
 
         # Set up the agent
-        self.agentRect = self.agentImg.get_rect()
+        self.agentRect = pygame.Rect(0, 0, TILE_SIZE, TILE_SIZE)
 
         # Define colours
         self.initialWalkableColours = [(199, 133, 60), (40, 126, 117), (255, 192, 203), (0, 209, 255), (202, 202, 202), (255, 245, 0), (79, 199, 60), (149, 143, 143), (66, 0, 255)]
@@ -55,12 +57,40 @@ class MinecraftCartEnv:
 
         # Initialize positions
         self.initialise_positions()
+        self.initialise_action_masks()
 
         self.maxSteps = 40 # 40 step rollout as in paper
 
-        self.clock = pygame.time.Clock()
         self.set_game()
 
+    def init_display(self):
+        # Initialize Pygame
+        pygame.init()
+
+        # Set up the display
+        self.screen = pygame.display.set_mode((self.mapWidth, self.mapHeight))
+        pygame.display.set_caption("Map Navigation Game")
+
+        # Load and scale the map
+        self.map = pygame.transform.scale(pygame.image.load(MAP_PATH), (self.mapWidth, self.mapHeight))
+
+        # Load and scale the images
+        self.agentImg = pygame.transform.scale(pygame.image.load("agent.png"), (20, 20))
+        self.diamondBlockImg = pygame.transform.scale(pygame.image.load("diamondBlock.png"), (20, 20))
+        self.trackImg = pygame.transform.scale(pygame.image.load("track.png"), (20, 20))
+        self.distractorsImg = pygame.transform.scale(pygame.image.load("distractor.png"), (20, 20))
+        self.floorImg = pygame.transform.scale(pygame.image.load("floor.png"), (20, 20))
+        self.pickaxeImg = pygame.transform.scale(pygame.image.load("pickaxe.png"), (20, 20))
+        self.cartImg = pygame.transform.scale(pygame.image.load("cart.png"), (20, 20))
+        self.spadeImg = pygame.transform.scale(pygame.image.load("spade.png"), (20, 20))
+
+        # Remove black backgrounds
+        self.agentImg.set_colorkey((0, 0, 0))
+        self.pickaxeImg.set_colorkey((0, 0, 0))
+        self.spadeImg.set_colorkey((0, 0, 0))
+
+        self.clock = pygame.time.Clock()
+
 # ------ Game update triggered by action with optional rendering ------
 
     def step(self, move, strafe, use, render=True):
@@ -96,7 +126,7 @@ class MinecraftCartEnv:
             else:
                 self.agentRect.topleft = newPos
 
-            self.water_trap(self.map.get_at(newPos)[:3])
+            self.water_trap(self.tiles[newPos])
             self.check_pickaxe_collection(newPos)
             self.check_spade_collection(newPos)
 
@@ -105,7 +135,7 @@ class MinecraftCartEnv:
         observation = self.observation()
         done = self.stepCount + 1 >= self.maxSteps
 
-        if render:
+        if render and not self.headless:
             self.render()
 
         self.stepCount += 1
@@ -147,7 +177,7 @@ class MinecraftCartEnv:
     def find_start(self):
         for y in range(0, self.mapHeight, 20):
             for x in range(0, self.mapWidth, 20):
-                if self.map.get_at((x, y)) == (255, 192, 203):
+                if self.tiles[(x, y)] == (255, 192, 203):
                     return (x, y)
         raise ValueError("Error: Could not find starting position")
 
@@ -164,7 +194,7 @@ class MinecraftCartEnv:
 
         for y in range(0, self.mapHeight, 20):
             for x in range(0, self.mapWidth, 20):
-                colour = self.map.get_at((x, y))[:3]
+                colour = self.tiles[(x, y)]
                 if colour == self.diamondColour:
                     self.diamondPos.add((x, y))
                     self.diamondPos_all.add((x,y))
@@ -186,6 +216,36 @@ class MinecraftCartEnv:
                     self.spadePos = (x, y)
                     self.initialSpadePos = (x, y)
 
+    # Utilities for masking out actions that would be no-ops. The static part
+    # (walls, water trap) is precomputed per tile; diamonds, the cart and the
+    # pickaxe are applied on top from the current state.
+
+    def initialise_action_masks(self):
+        self.tileActionMasks = {}
+        for waterTrapped, walkableColours in ((False, self.initialWalkableColours), (True, [self.specialColour])):
+            masks = {}
+            for (x, y) in self.tiles:
+                masks[(x, y)] = np.array([self.tiles.get((x + dx, y + dy)) in walkableColours
+                                          for dx, dy in MOVE_OFFSETS] + [False])
+            self.tileActionMasks[waterTrapped] = masks
+
+    def valid_action_mask(self):
+        x, y = self.agentRect.topleft
+        waterTrapped = self.walkableColours == [self.specialColour]
+        mask = self.tileActionMasks[waterTrapped][(x, y)].copy()
+        for i, (dx, dy) in enumerate(MOVE_OFFSETS):
+            target = (x + dx, y + dy)
+            if not mask[i]:
+                continue
+            if target in self.diamondPos:
+                mask[i] = False
+            elif target == self.cartPos:
+                # Walking into the cart only does something when pushing it sideways
+                mask[i] = dx != 0 and not self.cartStuck and (self.cartPos[0] + dx, self.cartPos[1]) in self.trackPos
+        mask[4] = self.hasPickaxe and any((x + dx, y + dy) in self.diamondPos
+                                          for dx, dy in [(0, 0), (20, 0), (-20, 0), (0, 20), (0, -20)])
+        return mask
+
     # Utility for setting initial game state
 
     def set_game(self):
@@ -199,6 +259,29 @@ class MinecraftCartEnv:
         self.walkableColours = self.initialWalkableColours.copy()
         self.stepCount = 0
 
+    # Utilities for capturing and restoring the full dynamic game state
+    # (agent tile, held tool, cart tile and stuck flag, water trap flag and
+    # diamond mask). Note the diamond mask survives set_game, so it is part
+    # of the state a new episode starts from.
+
+    def get_state(self):
+        heldTool = 1 if self.hasPickaxe else 2 if self.hasSpade else 0
+        waterTrapped = self.walkableColours == [self.specialColour]
+        diamondMask = tuple(1 if pos in self.diamondPos else 0 for pos in self.diamondPos_all)
+        return (self.agentRect.topleft, heldTool, self.cartPos, self.cartStuck, waterTrapped, diamondMask)
+
+    def set_state(self, state):
+        agentPos, heldTool, cartPos, cartStuck, waterTrapped, diamondMask = state
+        self.agentRect.topleft = agentPos
+        self.hasPickaxe = heldTool == 1
+        self.hasSpade = heldTool == 2
+        self.pickaxePos = None if self.hasPickaxe else self.initialPickaxePos
+        self.spadePos = None if self.hasSpade else self.initialSpadePos
+        self.cartPos = cartPos
+        self.cartStuck = cartStuck
+        self.walkableColours = [self.specialColour] if waterTrapped else self.initialWalkableColours.copy()
+        self.diamondPos = {pos for pos, present in zip(self.diamondPos_all, diamondMask) if present}
+
     # Utility for removing diamond block if on adjacent square
 
     def use_action(self):
@@ -235,11 +318,8 @@ class MinecraftCartEnv:
     def is_walkable(self, pos):
         if pos in self.diamondPos:
             return False
-        try:
-            colour = self.map.get_at(pos)
-            return colour[:3] in self.walkableColours
-        except IndexError:
-            return False
+        colour = self.tiles.get(pos)
+        return colour is not None and colour in self.walkableColours
 
     def water_trap(self, currentTileColour):
         if currentTileColour == self.specialColour:
@@ -295,4 +375,4 @@ class MinecraftCartEnv:
 
     def close(self):
         pygame.quit()
-        sys.exit()
\ No newline at end of file
+        sys.exit()
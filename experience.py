@@ -1,16 +1,61 @@
+import itertools
+from collections import OrderedDict
 import numpy as np
+from memory import experience_nbytes
+from utils import ACTIONS, action_to_index
 
 class Experience:
-    def __init__(self, goal_space, goal, trajectory, final_observation):
+    def __init__(self, goal_space, goal, trajectory, final_observation, initial_state=None, replayer=None):
         self.goal_space = goal_space
         self.goal = goal
-        self.trajectory = trajectory
         self.final_observation = final_observation
+        self.initial_state = initial_state  # Env state the rollout started from
+        self.imported = False  # Received from another island; never re-exported
+        self.exported = False  # Already sent to the other islands
+        self.replayer = None
+        self.actions = None
+        self.param_keys = None
+        self._trajectory = trajectory
         self.fitness = self._calculate_fitness()
+        self.nbytes = 0  # Approximate size in bytes, kept current for memory budgets
+        if replayer is not None:
+            self.compact(replayer)
+        else:
+            self.nbytes = experience_nbytes(self)
 
     def _calculate_fitness(self):
         return self.goal_space.get_fitness(self.final_observation, self.goal)
 
+    # Compact storage keeps only action codes and param keys. The env is
+    # deterministic given the actions, so the full observation sequence is
+    # rebuilt on demand by replaying from the initial state.
+
+    def compact(self, replayer):
+        if self.replayer is not None:
+            return
+        assert self.initial_state is not None, "compact storage needs the rollout's initial env state"
+        self.actions = np.array([action_to_index(step[18:21]) for step in self._trajectory], dtype=np.uint8)
+        self.param_keys = np.array([step[-1] for step in self._trajectory], dtype=np.int32)
+        self.replayer = replayer
+        self.replay_id = replayer.next_id()
+        self._trajectory = None
+        self.nbytes = experience_nbytes(self)
+
+    @property
+    def is_compact(self):
+        return self.replayer is not None
+
+    @property
+    def trajectory(self):
+        if self.replayer is None:
+            return self._trajectory
+        return self.replayer.rebuild(self)
+
+    def get_param_keys(self):
+        if self.replayer is None:
+            return [step[-1] for step in self._trajectory]
+        return self.param_keys.tolist()
+
     def get_relevant_trajectory(self, current_goal_space):
         relevant_trajectory = []
         for step in self.trajectory:
@@ -19,4 +64,39 @@ class Experience:
         return relevant_trajectory
 
     def __repr__(self):
-        return f"Experience(goal_space={self.goal_space.name}, goal={self.goal}, fitness={self.fitness:.4f})"
\ No newline at end of file
+        return f"Experience(goal_space={self.goal_space.name}, goal={self.goal}, fitness={self.fitness:.4f})"
+
+# ------ Lazy trajectory reconstruction for compact experiences ------
+
+class TrajectoryReplayer:
+    def __init__(self, env, cache_size=32):
+        self.env = env  # Dedicated headless env, never the one driving the main loop
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # replay_id -> rebuilt trajectory, least recently used first
+        self._ids = itertools.count()
+
+    def next_id(self):
+        return next(self._ids)
+
+    def rebuild(self, experience):
+        if experience.replay_id in self.cache:
+            self.cache.move_to_end(experience.replay_id)
+            return self.cache[experience.replay_id]
+
+        trajectory = self.replay(experience.initial_state, experience.actions, experience.param_keys)
+        self.cache[experience.replay_id] = trajectory
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return trajectory
+
+    def replay(self, initial_state, actions, param_keys):
+        self.env.set_state(initial_state)
+        self.env.stepCount = 0
+        observation = self.env.observation()
+        trajectory = []
+        for action_index, param_key in zip(actions, param_keys):
+            action = ACTIONS[action_index]
+            next_observation, _ = self.env.step(*action, render=False)
+            trajectory.append(tuple(observation) + action + (int(param_key),))
+            observation = next_observation
+        return trajectory
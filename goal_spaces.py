@@ -1,10 +1,23 @@
 import numpy as np
 import random
+from collections import deque
 
 class GoalSpace:
-    def __init__(self, name, dimension):
+    LOWER_HALF_PATH = [
+        (0.471, 0.739, 0.05),  # centre tile
+        (0.471, 0.696, 0.05), (0.471, 0.652, 0.045), (0.471, 0.609, 0.040), # path in front of centre
+        (0.412, 0.739, 0.075), (0.529, 0.739, 0.075),  # first left and right
+        (0.353, 0.739, 0.10), (0.588, 0.739, 0.10),  # second left and right
+        (0.353, 0.696, 0.20), (0.588, 0.696, 0.20),  # third left and right
+        (0.353, 0.652, 0.25), (0.588, 0.652, 0.25),  # fourth left and right
+        (0.294, 0.652, 0.30), (0.647, 0.652, 0.30),  # fifth left and right
+        (0.294, 0.609, 0.35), (0.647, 0.609, 0.35),  # sixth left and right
+    ]
+
+    def __init__(self, name, dimension, lp_window=100):
         self.name = name
         self.dimension = dimension
+        self.lp_window = lp_window  # Rollouts over which hindsight competence progress is measured
         self.goals = self._initialize_goals()
         self.learning_progress = 0
         self.goal_data = {}
@@ -46,9 +59,36 @@ class GoalSpace:
         return random.choice(list(self.goals.values()))
 
     def update_learning_progress(self, new_experience):
-        goal = str(new_experience.goal)
-        new_fitness = new_experience.fitness
-        
+        self._update_goal_progress(str(new_experience.goal), new_experience.fitness)
+        self._update_overall_progress()
+
+    # Hindsight update: every goal in this space is scored against the same
+    # rollout, so each one gets an LP update per rollout, not just the sampled
+    # goal. Most rollouts were aimed at other goals, so the last-rollout delta
+    # used above would just compare unrelated rollouts. Instead LP here is
+    # competence progress: how much the best fitness ever reached for the goal
+    # rose over the last lp_window rollouts. A goal that stopped improving
+    # drops to exactly 0 once the window has passed.
+
+    def update_all_goals(self, observations):
+        fitness = self.get_fitness_batch(observations, list(self.goals.values()))
+        final_fitness = fitness[-1]
+        best_along_rollout = fitness.max(axis=0)
+        for i, goal in enumerate(self.goals.values()):
+            self._update_goal_competence(str(goal), final_fitness[i], best_along_rollout[i])
+        self._update_overall_progress()
+
+    def _update_goal_competence(self, goal, new_fitness, best_fitness):
+        if goal not in self.goal_data:
+            self.goal_data[goal] = {'last_fitness': new_fitness, 'learning_progress': 0, 'best_fitness': best_fitness,
+                                    'best_history': deque(maxlen=self.lp_window + 1)}
+        data = self.goal_data[goal]
+        data['best_fitness'] = max(data['best_fitness'], best_fitness)
+        data['best_history'].append(data['best_fitness'])
+        data['learning_progress'] = data['best_history'][-1] - data['best_history'][0]
+        data['last_fitness'] = new_fitness
+
+    def _update_goal_progress(self, goal, new_fitness):
         if goal in self.goal_data:
             old_fitness = self.goal_data[goal]['last_fitness']
             immediate_progress = new_fitness - old_fitness
@@ -69,9 +109,11 @@ class GoalSpace:
             
             self.goal_data[goal]['last_fitness'] = new_fitness
             self.goal_data[goal]['learning_progress'] = learning_progress
+            self.goal_data[goal]['best_fitness'] = max(self.goal_data[goal]['best_fitness'], new_fitness)
         else:
-            self.goal_data[goal] = {'last_fitness': new_fitness, 'learning_progress': new_fitness}
-        
+            self.goal_data[goal] = {'last_fitness': new_fitness, 'learning_progress': new_fitness, 'best_fitness': new_fitness}
+
+    def _update_overall_progress(self):
         # Update overall learning progress for this goal space
         active_goals = [data['learning_progress'] for data in self.goal_data.values() if data['learning_progress'] != 0]
         self.learning_progress = np.mean(active_goals) if active_goals else 0
@@ -109,18 +151,8 @@ class GoalSpace:
         return self._goal_directed_fitness(pos, goal)
 
     def _lower_half_fitness(self, pos):
-        path_positions = [
-            (0.471, 0.739, 0.05),  # centre tile
-            (0.471, 0.696, 0.05), (0.471, 0.652, 0.045), (0.471, 0.609, 0.040), # path in front of centre
-            (0.412, 0.739, 0.075), (0.529, 0.739, 0.075),  # first left and right
-            (0.353, 0.739, 0.10), (0.588, 0.739, 0.10),  # second left and right
-            (0.353, 0.696, 0.20), (0.588, 0.696, 0.20),  # third left and right
-            (0.353, 0.652, 0.25), (0.588, 0.652, 0.25),  # fourth left and right
-            (0.294, 0.652, 0.30), (0.647, 0.652, 0.30),  # fifth left and right
-            (0.294, 0.609, 0.35), (0.647, 0.609, 0.35),  # sixth left and right
-        ]
             
-        for x, y, reward in path_positions:
+        for x, y, reward in self.LOWER_HALF_PATH:
             if np.allclose(pos, [x, y], atol=0.01):
                 return reward
         
@@ -170,24 +202,82 @@ class GoalSpace:
         
         return np.exp(-2 * (blocks_to_break - broken_correct_blocks))  # Exponential weighting
 
+    # Vectorized fitness: scores N observations against G goals in one pass,
+    # returning an (N, G) array that matches get_fitness element for element
+
+    def get_fitness_batch(self, observations, goals):
+        observations = np.asarray(observations)
+        goals = np.asarray(goals, dtype=np.float64)
+
+        if self.name == 'agent':
+            pos = observations[:, :2]
+            lower = self._lower_half_fitness_batch(pos)[:, None]
+            base = self._goal_directed_fitness_batch(pos, goals)
+            upper = np.where(base <= 0.35, 0.35 + 0.15, base)
+            return np.where(pos[:, 1:2] > 0.565, lower, upper)
+        elif self.name in ['pickaxe', 'shovel']:
+            if self.name == 'pickaxe':
+                pos, start = observations[:, 2:4], (0.412, 0.565)
+            else:
+                pos, start = observations[:, 4:6], (0.529, 0.565)
+            rounded = np.round(pos, 3)
+            not_collected = (rounded[:, 0] - start[0] <= 0.01) & (rounded[:, 1] - start[1] <= 0.01)
+            return np.where(not_collected[:, None], 0, self._goal_directed_fitness_batch(pos, goals))
+        elif self.name == 'cart':
+            cart_pos = observations[:, 6:7]
+            fitness = np.exp(-5 * np.abs(cart_pos - goals[None, :]))
+            return np.where(np.abs(cart_pos - 0.471) < 0.01, 0, fitness)
+        elif self.name == 'blocks':
+            broken = observations[:, None, 11:16] == 0
+            targets = goals == 0
+            blocks_to_break = targets.sum(axis=1)
+            broken_correct_blocks = (broken & targets[None, :, :]).sum(axis=2)
+            fitness = np.where(broken_correct_blocks == 0, 0, np.exp(-2 * (blocks_to_break - broken_correct_blocks)))
+            return np.where(blocks_to_break == 0, 1, fitness)
+        else:
+            raise ValueError(f"Unknown goal space: {self.name}")
+
+    def _lower_half_fitness_batch(self, pos):
+        fitness = np.zeros(len(pos))
+        matched = np.zeros(len(pos), dtype=bool)
+        for x, y, reward in self.LOWER_HALF_PATH:
+            on_tile = np.isclose(pos, [x, y], atol=0.01).all(axis=1) & ~matched
+            fitness[on_tile] = reward
+            matched |= on_tile
+        return fitness
+
+    def _goal_directed_fitness_batch(self, pos, goals):
+        y_diff = np.abs(pos[:, None, 1] - goals[None, :, 1])
+        x_diff = np.abs(pos[:, None, 0] - goals[None, :, 0])
+
+        y_fitness = np.exp(-5 * y_diff)
+        x_fitness = np.exp(-5 * x_diff)
+        return np.where(y_diff < 0.05, np.minimum((y_fitness + x_fitness) / 2, 1), np.minimum(y_fitness / 2, 1))
+
 class GoalSpaceManager:
-    def __init__(self):
+    def __init__(self, lp_choice_prob=0.8, lp_window=100):
+        self.lp_choice_prob = lp_choice_prob
         self.goal_spaces = {
-            'agent': GoalSpace('agent', 2),
-            'pickaxe': GoalSpace('pickaxe', 2),
-            'shovel': GoalSpace('shovel', 2),
-            'cart': GoalSpace('cart', 1),
-            'blocks': GoalSpace('blocks', 5)
+            'agent': GoalSpace('agent', 2, lp_window),
+            'pickaxe': GoalSpace('pickaxe', 2, lp_window),
+            'shovel': GoalSpace('shovel', 2, lp_window),
+            'cart': GoalSpace('cart', 1, lp_window),
+            'blocks': GoalSpace('blocks', 5, lp_window)
         }
 
+    def hindsight_update(self, trajectory, final_observation):
+        observations = np.array([step[:18] for step in trajectory] + [final_observation], dtype=np.float32)
+        for goal_space in self.goal_spaces.values():
+            goal_space.update_all_goals(observations)
+
     def choose_goal_space(self):
-        if round(random.random(), 1) <= 0.8:  # 80% chance of choosing based on learning progress
-            lp_values = [gs.learning_progress for gs in self.goal_spaces.values()]
+        if round(random.random(), 1) <= self.lp_choice_prob:  # 80% chance (by default) of choosing based on learning progress
+            lp_values = [max(gs.learning_progress, 0) for gs in self.goal_spaces.values()]  # Regressing spaces get no LP weight
             total_lp = sum(lp_values)
             if total_lp == 0:
                 return random.choice(list(self.goal_spaces.values()))
             else:
                 chosen_index = np.random.choice(len(self.goal_spaces), p=[lp/total_lp for lp in lp_values])
                 return list(self.goal_spaces.values())[chosen_index]
-        else:  # 20% chance of random selection
+        else:  # Otherwise random selection
             return random.choice(list(self.goal_spaces.values()))
\ No newline at end of file
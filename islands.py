@@ -0,0 +1,319 @@
+import io
+import json
+import multiprocessing as mp
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+from collections import deque
+import numpy as np
+import torch
+from env import MinecraftCartEnv, compile_map
+from experience import Experience, TrajectoryReplayer
+from main import run
+from sweep import init_worker, worker_seed, worker_tiles
+from transition_model import TransitionModel
+from utils import action_to_index
+
+NUM_ISLANDS = 4
+EXCHANGE_EVERY = 200  # Iterations between exchanges with the broker
+ISLAND_CONFIG = {
+    'num_iterations': 4000,
+    'compiled_env': True,
+    'compact_trajectories': True,
+}
+
+# ------ Wire format ------
+
+# Every message is a length-prefixed JSON header followed by the raw binary
+# frames it announces. Batches of experiences travel as one such frame: an
+# npz archive of plain arrays with its JSON metadata stored inside, written
+# by the sending island and passed through the broker as opaque bytes. Nothing
+# on the wire is ever unpickled, so a reachable port can't run code on an island.
+
+def send_message(sock, message, blobs=()):
+    frames = [json.dumps({**message, 'num_blobs': len(blobs)}).encode(), *blobs]
+    sock.sendall(b''.join(struct.pack('!I', len(frame)) + frame for frame in frames))
+
+def recv_message(sock):
+    header = _recv_frame(sock)
+    if header is None:
+        return None, []
+    message = json.loads(header)
+    blobs = []
+    for _ in range(message.pop('num_blobs')):
+        blob = _recv_frame(sock)
+        if blob is None:
+            raise ConnectionError("Connection closed mid-message")
+        blobs.append(blob)
+    return message, blobs
+
+def _recv_frame(sock):
+    header = _recv_exactly(sock, 4)
+    if header is None:
+        return None
+    payload = _recv_exactly(sock, struct.unpack('!I', header)[0])
+    if payload is None:
+        raise ConnectionError("Connection closed mid-message")
+    return payload
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def encode_batch(batch):
+    metadata = {'experiences': [], 'parameters': {}}
+    arrays = {}
+    for i, item in enumerate(batch['experiences']):
+        metadata['experiences'].append({'goal_space': item['goal_space'], 'goal': item['goal']})
+        for field in ('actions', 'param_keys', 'final_observation', 'initial_state'):
+            arrays[f'{field}_{i}'] = item[field]
+    for key, parameters in batch['parameters'].items():
+        metadata['parameters'][str(key)] = list(parameters)
+        for name, param in parameters.items():
+            arrays[f'param_{key}_{name}'] = param
+    arrays['metadata'] = np.frombuffer(json.dumps(metadata).encode(), dtype=np.uint8)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+def decode_batch(blob):
+    with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+        metadata = json.loads(data['metadata'].tobytes())
+        experiences = [{**item, **{field: data[f'{field}_{i}'] for field in
+                                   ('actions', 'param_keys', 'final_observation', 'initial_state')}}
+                       for i, item in enumerate(metadata['experiences'])]
+        parameters = {int(key): {name: data[f'param_{key}_{name}'] for name in names}
+                      for key, names in metadata['parameters'].items()}
+    return {'experiences': experiences, 'parameters': parameters}
+
+def is_unix_address(address):
+    return isinstance(address, str)
+
+# ------ Message broker ------
+
+# A tiny publish/fetch log. Islands publish compressed batches and fetch
+# every batch published by other islands since their last fetch. The log
+# is bounded, so a slow island only misses old batches instead of growing
+# the broker without limit. Works over TCP ((host, port) address) or a
+# Unix socket (path address) as a local stand-in.
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request, blobs = recv_message(self.request)
+                if request is None:
+                    return
+                response, response_blobs = self.server.broker.handle(request, blobs)
+            except (ConnectionError, ValueError, KeyError, IndexError, TypeError):
+                return  # Malformed or truncated request: drop the connection
+            send_message(self.request, response, response_blobs)
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+class _ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+class MessageBroker:
+    def __init__(self, address, max_batches=1000):
+        self.log = deque(maxlen=max_batches)  # (seq, island, compressed batch)
+        self.next_seq = 0
+        self.lock = threading.Lock()
+        server_class = _ThreadingUnixServer if is_unix_address(address) else _ThreadingTCPServer
+        self.server = server_class(address, _BrokerHandler)
+        self.server.broker = self
+        self.address = self.server.server_address
+        self.thread = None
+
+    def handle(self, request, blobs):
+        with self.lock:
+            if request['op'] == 'publish':
+                self.log.append((self.next_seq, request['island'], blobs[0]))
+                self.next_seq += 1
+                return {'seq': self.next_seq - 1}, []
+            elif request['op'] == 'fetch':
+                batches = [(island, batch) for seq, island, batch in self.log
+                           if seq > request['since'] and island != request['island']]
+                return {'islands': [island for island, _ in batches], 'last_seq': self.next_seq - 1}, [batch for _, batch in batches]
+            else:
+                raise ValueError(f"Unknown broker op: {request['op']}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if is_unix_address(self.address) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+class BrokerClient:
+    def __init__(self, address, island_id):
+        self.island_id = island_id
+        family = socket.AF_UNIX if is_unix_address(address) else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.last_seq = -1
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def _request(self, request, blobs=()):
+        send_message(self.sock, request, blobs)
+        return recv_message(self.sock)
+
+    def publish(self, batch):
+        blob = encode_batch(batch)
+        self.bytes_sent += len(blob)
+        self._request({'op': 'publish', 'island': self.island_id}, [blob])
+
+    def fetch(self):
+        response, blobs = self._request({'op': 'fetch', 'island': self.island_id, 'since': self.last_seq})
+        self.last_seq = response['last_seq']
+        self.bytes_received += sum(len(blob) for blob in blobs)
+        return [(island, decode_batch(blob)) for island, blob in zip(response['islands'], blobs)]
+
+    def close(self):
+        self.sock.close()
+
+# ------ Experience exchange ------
+
+# An island exports its best experience per goal (once per experience)
+# together with the policy weights its trajectory references. Only actions,
+# param keys and the initial state are sent; the importing island rebuilds
+# the observations by replaying the actions. Weights are registered under
+# fresh local keys (so parameter keys never collide) only for experiences the
+# archive accepts, and each (island, remote key) pair is registered once.
+
+def export_elites(components):
+    knowledge_base = components['knowledge_base']
+    parameter_space = components['policy_manager'].parameter_space
+    experiences = {}
+    for goal_space in components['goal_space_manager'].goal_spaces.values():
+        for goal in goal_space.goals.values():
+            experience = knowledge_base.get_relevant_experience(goal_space, goal)
+            if experience is None or experience.initial_state is None or experience.imported or experience.exported:
+                continue  # Only send elites that are new since the last exchange
+            experiences[id(experience)] = experience
+
+    batch = {'experiences': [], 'parameters': {}}
+    for experience in experiences.values():
+        experience.exported = True
+        param_keys = experience.get_param_keys()
+        if experience.is_compact:
+            actions = experience.actions
+        else:
+            actions = np.array([action_to_index(step[18:21]) for step in experience.trajectory], dtype=np.uint8)
+        batch['experiences'].append({
+            'goal_space': experience.goal_space.name,
+            'goal': experience.goal,
+            'actions': actions,
+            'param_keys': np.array(param_keys, dtype=np.int32),
+            'final_observation': np.asarray(experience.final_observation, dtype=np.float32),
+            'initial_state': TransitionModel.encode_states([experience.initial_state])[0],
+        })
+        for key in set(param_keys):
+            if key not in batch['parameters']:
+                batch['parameters'][key] = {name: param.numpy() for name, param in parameter_space[key].items()}
+    return batch
+
+def import_elites(island, batch, components, replayer, imported_keys, compact=False):
+    knowledge_base = components['knowledge_base']
+    goal_spaces = components['goal_space_manager'].goal_spaces
+
+    imported = 0
+    for item in batch['experiences']:
+        goal_space = goal_spaces[item['goal_space']]
+        if not knowledge_base.accepts(item['final_observation'], goal_space.get_fitness(item['final_observation'], item['goal'])):
+            continue
+        local_keys = {key: _local_key(components['policy_manager'], imported_keys, island, key, batch['parameters'])
+                      for key in set(item['param_keys'].tolist())}
+        initial_state = TransitionModel.decode_states([item['initial_state']])[0]
+        param_keys = [local_keys[key] for key in item['param_keys'].tolist()]
+        trajectory = replayer.replay(initial_state, item['actions'], param_keys)
+        experience = Experience(goal_space, item['goal'], trajectory,
+                                item['final_observation'], initial_state, replayer if compact else None)
+        experience.imported = True
+        knowledge_base.add_experience(experience)
+        imported += 1
+    return imported
+
+def _local_key(policy_manager, imported_keys, island, remote_key, parameters):
+    local_key = imported_keys.get((island, remote_key))
+    if local_key not in policy_manager.parameter_space:  # New, or dropped by a memory budget since
+        policy_manager.current_key += 1
+        local_key = imported_keys[(island, remote_key)] = policy_manager.current_key
+        policy_manager.parameter_space[local_key] = {
+            name: torch.from_numpy(param.copy()) for name, param in parameters[remote_key].items()}
+    return local_key
+
+# ------ Island process ------
+
+def run_island(island_id, broker_address, config, exchange_every=EXCHANGE_EVERY):
+    client = BrokerClient(broker_address, island_id)
+    exchange = {'exported': 0, 'imported': 0}
+    imported_keys = {}  # (island, remote param key) -> local param key
+    compact = config.get('compact_trajectories', False)
+    replayer = None
+
+    def on_iteration(iteration, components):
+        nonlocal replayer
+        if (iteration + 1) % exchange_every:
+            return
+        batch = export_elites(components)
+        client.publish(batch)
+        exchange['exported'] += len(batch['experiences'])
+        if replayer is None:  # The run's own replayer, or a headless one built on first exchange
+            replayer = components['replayer'] or TrajectoryReplayer(MinecraftCartEnv(tiles=worker_tiles(), headless=True), cache_size=0)
+        for island, incoming in client.fetch():
+            exchange['imported'] += import_elites(island, incoming, components, replayer, imported_keys, compact)
+
+    island_config = {**config, 'headless': True, 'seed': worker_seed(config.get('seed'), island_id)}
+    stats, components = run(island_config, tiles=worker_tiles(), verbose=False, on_iteration=on_iteration)
+    client.close()
+    return {
+        'island': island_id,
+        'seed': island_config['seed'],
+        'final_lp': stats['final_lp'],
+        'cells': len(components['knowledge_base'].cells),
+        'iterations_per_sec': stats['iterations_per_sec'],
+        'bytes_sent': client.bytes_sent,
+        'bytes_received': client.bytes_received,
+        **exchange,
+    }
+
+def run_islands(num_islands=NUM_ISLANDS, config=ISLAND_CONFIG, address=None, exchange_every=EXCHANGE_EVERY):
+    # Default to a Unix socket in a temp dir; pass ('127.0.0.1', 0) for TCP on a free port
+    if address is None:
+        with tempfile.TemporaryDirectory() as socket_dir:
+            return run_islands(num_islands, config, os.path.join(socket_dir, "islands.sock"), exchange_every)
+    tiles = compile_map()
+    with mp.Pool(num_islands, initializer=init_worker, initargs=(tiles,)) as pool:
+        # Started after the pool forks so workers don't inherit the broker's thread
+        broker = MessageBroker(address).start()
+        try:
+            return pool.starmap(run_island, [(i, broker.address, config, exchange_every) for i in range(num_islands)])
+        finally:
+            broker.stop()
+
+def main():
+    results = run_islands()
+    for result in results:
+        print(f"Island {result['island']} | cells: {result['cells']} | exported: {result['exported']} | "
+              f"imported: {result['imported']} | sent: {result['bytes_sent'] / 1024:.1f} KB | "
+              f"LP: { {name: round(lp, 3) for name, lp in result['final_lp'].items()} }")
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,114 @@
 import numpy as np
 from scipy.spatial import cKDTree
-from collections import deque
+from env import MAP_WIDTH, MAP_HEIGHT, TILE_SIZE
+
+# ------ Behaviour descriptor ------
+
+# Experiences are binned by where they end up: agent tile, pickaxe tile,
+# spade tile, cart x tile and the diamond mask (observation[13:18]). The
+# other observation entries are the fixed distractor positions, so the
+# descriptor identifies a final observation exactly. All experiences in a
+# cell therefore score the same on every goal, and only the cell's elite(s)
+# need to be kept.
+
+def behaviour_descriptor(observation):
+    cols, rows = MAP_WIDTH // TILE_SIZE, MAP_HEIGHT // TILE_SIZE
+    observation = np.asarray(observation)
+    return (
+        round(float(observation[0]) * cols), round(float(observation[1]) * rows),  # agent
+        round(float(observation[2]) * cols), round(float(observation[3]) * rows),  # pickaxe
+        round(float(observation[4]) * cols), round(float(observation[5]) * rows),  # spade
+        round(float(observation[6]) * cols),  # cart
+        *(int(block) for block in observation[13:18]),  # diamond mask
+    )
+
+# ------ MAP-Elites style archive ------
 
 class KnowledgeBase:
-    def __init__(self, max_size=1000):
-        self.experiences = deque(maxlen=max_size)
+    def __init__(self, max_size=10000, cell_capacity=1):
+        self.max_size = max_size  # Maximum number of occupied cells
+        self.cell_capacity = cell_capacity  # Elites kept per cell
+        self.cells = {}  # descriptor -> elites, best first; dict order is cell creation order
+        self.best_cells = {}  # (goal space name, goal) -> [goal_space, goal, fitness, descriptor]
+        self.nbytes = 0  # Running total of the stored experiences' sizes, see memory.experience_nbytes
+
+    @property
+    def experiences(self):
+        return [experience for cell in self.cells.values() for experience in cell]
+
+    def __len__(self):
+        return sum(len(cell) for cell in self.cells.values())
 
     def add_experience(self, experience):
-        self.experiences.appendleft(experience)
+        descriptor = behaviour_descriptor(experience.final_observation)
+        cell = self.cells.get(descriptor)
+        if cell is None:
+            if len(self.cells) >= self.max_size:
+                self.evict_lowest_cells()  # Least useful cell makes room
+            cell = self.cells[descriptor] = []
+
+        # Elites ordered by fitness on their own goal, newer first on ties
+        position = next((i for i, elite in enumerate(cell) if elite.fitness <= experience.fitness), len(cell))
+        if position >= self.cell_capacity:
+            return
+        cell.insert(position, experience)
+        self.nbytes += experience.nbytes
+        for dropped in cell[self.cell_capacity:]:
+            self.nbytes -= dropped.nbytes
+        del cell[self.cell_capacity:]
+
+        # Keep the best cell per tracked goal current
+        for entry in self.best_cells.values():
+            goal_space, goal, best_fitness, _ = entry
+            fitness = goal_space.get_fitness(experience.final_observation, goal)
+            if fitness >= best_fitness:
+                entry[2], entry[3] = fitness, descriptor
+
+    def accepts(self, final_observation, fitness):
+        # Whether add_experience would store an experience, without building it
+        cell = self.cells.get(behaviour_descriptor(final_observation))
+        return cell is None or len(cell) < self.cell_capacity or cell[-1].fitness <= fitness
 
     def get_relevant_experience(self, goal_space, goal):
-        if not self.experiences:
+        if not self.cells:
             return None
-        
-        test_scores = []
-        for i in range(len(self.experiences)):
-            test_scores.append((i, goal_space.get_fitness(self.experiences[i].final_observation, goal)))
 
-        #if goal_space.name == 'agent':
-        #    print(f'\n--------LIST OF FITNESS SCORES FOR CURRENT AGENT GOAL--------\nExperiences Deque is: {len(self.experiences)} long.\n{test_scores}')
+        key = (goal_space.name, str(goal))
+        if key not in self.best_cells:
+            self.best_cells[key] = self._find_best_cell(goal_space, goal)
+        return self.cells[self.best_cells[key][3]][0]
+
+    def _find_best_cell(self, goal_space, goal):
+        descriptors = list(self.cells)
+        final_observations = np.array([self.cells[d][0].final_observation for d in descriptors])
+        fitness = goal_space.get_fitness_batch(final_observations, [goal])[:, 0]
+        best = len(fitness) - 1 - int(np.argmax(fitness[::-1]))  # Most recently created cell wins ties
+        return [goal_space, goal, fitness[best], descriptors[best]]
+
+    # Eviction never looks at age alone: cells that are currently best for a
+    # tracked goal are kept, and the rest go in order of their best fitness
+    # over all tracked goals (oldest first among equals).
+
+    def evict_lowest_cells(self, count=1):
+        descriptors = list(self.cells)
+        protected = {entry[3] for entry in self.best_cells.values()}
+        values = np.zeros(len(descriptors))
+        if self.best_cells:
+            final_observations = np.array([self.cells[d][0].final_observation for d in descriptors])
+            for goal_space, goal, _, _ in self.best_cells.values():
+                values = np.maximum(values, goal_space.get_fitness_batch(final_observations, [goal])[:, 0])
+        order = sorted(range(len(descriptors)), key=lambda i: (descriptors[i] in protected, values[i]))
+        for i in order[:count]:
+            self._evict_cell(descriptors[i])
 
-        best_experience = max(self.experiences, 
-                              key=lambda exp: goal_space.get_fitness(exp.final_observation, goal))
-        
-        #if goal_space.name == 'agent':
-        #    print(f'INDEX OF BEST PREVIOUS AGENT EXPERIENCE:{self.experiences.index(best_experience)}\n')
+    def _evict_cell(self, descriptor):
+        self.nbytes -= sum(experience.nbytes for experience in self.cells.pop(descriptor))
+        for key in [key for key, entry in self.best_cells.items() if entry[3] == descriptor]:
+            del self.best_cells[key]  # Recomputed on the next lookup
 
-        return best_experience
\ No newline at end of file
+    def compact(self, replayer):
+        for experience in self.experiences:
+            if experience.initial_state is not None and not experience.is_compact:
+                self.nbytes -= experience.nbytes
+                experience.compact(replayer)
+                self.nbytes += experience.nbytes
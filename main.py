@@ -3,21 +3,94 @@ from goal_spaces import GoalSpaceManager
 from knowledge_base import KnowledgeBase
 from policy_manager import PolicyManager
 from neural_network import NeuralNetwork
-from experience import Experience
+from experience import Experience, TrajectoryReplayer
+from transition_model import TransitionModel, CompiledCartEnv
+from memory import MemoryTelemetry, MemoryBudget, format_report
 import random
+import time
 import numpy as np
+import torch
 from utils import action_to_string
 
 NUM_ITERATIONS = 40000
 EXPLORE_PROB = 0.8
 
-def main():
-    # Initialize components
-    env = MinecraftCartEnv()
-    goal_space_manager = GoalSpaceManager()
-    knowledge_base = KnowledgeBase()
+# Every tunable setting of a run. Sweeps override any subset of these keys.
+DEFAULT_CONFIG = {
+    'num_iterations': NUM_ITERATIONS,
+    'explore_prob': EXPLORE_PROB,
+    'mutation_strength': 0.3,
+    'kb_max_size': 10000,  # Maximum number of occupied archive cells (the map has 8377 reachable outcomes)
+    'kb_cell_capacity': 1,  # Elites kept per archive cell
+    'exploit_exploration_rate': 0.1,  # Chance of an exploratory step while exploiting
+    'lp_choice_prob': 0.8,
+    'mask_invalid_actions': False,  # Mask no-op actions using the env's per-tile valid-action mask (opt-in: lowered archive coverage in testing)
+    'seed': None,
+    'headless': False,
+    'compiled_env': False,  # Step through precomputed transition tables instead of the pygame env
+    'compact_trajectories': False,  # Store only actions per experience and replay observations on demand
+    'replay_cache_size': 32,
+    'hindsight_lp': True,  # Score every rollout against all goals of all goal spaces for LP
+    'lp_window': 100,  # Rollouts over which hindsight LP measures the rise in best fitness
+    'fitness_window': 100,  # Iterations averaged into each point of the fitness curves
+    'memory_report_every': 0,  # Iterations between byte-accurate memory reports (0 disables)
+    'tracemalloc': False,  # Also sample the main loop's Python heap with tracemalloc
+    'parameter_archive_budget': None,  # Byte budgets on the estimated archive sizes, enforced every memory_check_every iterations
+    'knowledge_base_budget': None,
+    'memory_check_every': 1,
+}
+
+def build_components(config, tiles=None):
+    if config['compiled_env']:
+        model = TransitionModel.load_or_build(tiles)
+        env = CompiledCartEnv(model)
+    else:
+        env = MinecraftCartEnv(tiles=tiles, headless=config['headless'])
+
+    replayer = None
+    if config['compact_trajectories'] or config['knowledge_base_budget'] is not None:
+        replay_env = CompiledCartEnv(model) if config['compiled_env'] else MinecraftCartEnv(tiles=env.tiles, headless=True)
+        replayer = TrajectoryReplayer(replay_env, cache_size=config['replay_cache_size'])
+
+    goal_space_manager = GoalSpaceManager(lp_choice_prob=config['lp_choice_prob'], lp_window=config['lp_window'])
+    knowledge_base = KnowledgeBase(max_size=config['kb_max_size'], cell_capacity=config['kb_cell_capacity'])
     neural_network = NeuralNetwork(input_dim=18, hidden_dim=64, output_dim=5)  # 18 for observation + 2 for goal, 5 possible actions
-    policy_manager = PolicyManager(neural_network)
+    policy_manager = PolicyManager(neural_network,
+                                   mutation_strength=config['mutation_strength'],
+                                   exploration_rate=config['exploit_exploration_rate'],
+                                   mask_invalid_actions=config['mask_invalid_actions'])
+    return {
+        'env': env,
+        'goal_space_manager': goal_space_manager,
+        'knowledge_base': knowledge_base,
+        'policy_manager': policy_manager,
+        'replayer': replayer,
+    }
+
+def run(config=None, tiles=None, verbose=True, on_iteration=None):
+    config = {**DEFAULT_CONFIG, **(config or {})}
+
+    if config['seed'] is not None:
+        random.seed(config['seed'])
+        np.random.seed(config['seed'])
+        torch.manual_seed(config['seed'])
+
+    # Initialize components
+    components = build_components(config, tiles)
+    env = components['env']
+    goal_space_manager = components['goal_space_manager']
+    knowledge_base = components['knowledge_base']
+    policy_manager = components['policy_manager']
+    replayer = components['replayer'] if config['compact_trajectories'] else None  # Compacts every new experience when set
+
+    telemetry = None
+    if config['memory_report_every'] or config['tracemalloc']:
+        telemetry = MemoryTelemetry(report_every=config['memory_report_every'] or 1000, trace=config['tracemalloc'])
+    budget = None
+    if config['parameter_archive_budget'] is not None or config['knowledge_base_budget'] is not None:
+        budget = MemoryBudget(parameter_archive_bytes=config['parameter_archive_budget'],
+                              knowledge_base_bytes=config['knowledge_base_budget'],
+                              check_every=config['memory_check_every'])
 
     # Variables for tracking progress:
     exploration_count = 0
@@ -27,20 +100,21 @@ def main():
     shovel_exploitations = 0
     cart_exploitations = 0
     block_exploitations = 0
-    agent_current_LP = 0
-    pickaxe_current_LP = 0
-    shovel_current_LP = 0
-    cart_current_LP = 0
-    block_current_LP = 0
 
-    for iteration in range(NUM_ITERATIONS):
+    # Fitness curves: mean rollout fitness per goal space over each window of iterations
+    fitness_curves = {name: [] for name in goal_space_manager.goal_spaces}
+    window_fitness = {name: [] for name in goal_space_manager.goal_spaces}
+    env_steps = 0
+    start_time = time.perf_counter()
+
+    for iteration in range(config['num_iterations']):
         # Choose goal space and goal
         goal_space = goal_space_manager.choose_goal_space()
         goal = goal_space.sample_goal()
 
         # Choose exploration or exploitation [Plus record amount of choice for info later]
         policy_pick = round(random.random(), 1)
-        if policy_pick <= EXPLORE_PROB:
+        if policy_pick <= config['explore_prob']:
             policy_type = 'explore'
             exploration_count += 1
         else:
@@ -56,49 +130,96 @@ def main():
         relevant_experience = knowledge_base.get_relevant_experience(goal_space, goal)
 
         # Execute policy
+        initial_state = env.get_state()
         trajectory, final_observation = policy.execute(env, goal_space, goal, relevant_experience)
+        env_steps += len(trajectory)
 
         # Create new experience
-        new_experience = Experience(goal_space, goal, trajectory, final_observation)
+        new_experience = Experience(goal_space, goal, trajectory, final_observation, initial_state, replayer)
+        window_fitness[goal_space.name].append(new_experience.fitness)
 
         # Update knowledge base
         knowledge_base.add_experience(new_experience)
 
-        # Update goal space (if exploiting)
+        # Update goal spaces: every goal from every rollout (hindsight), or only the sampled goal when exploiting
+        if config['hindsight_lp']:
+            goal_space_manager.hindsight_update(trajectory, final_observation)
+
         if policy == policy_manager.exploitation_policy:
-            goal_space.update_learning_progress(new_experience)
+            if not config['hindsight_lp']:
+                goal_space.update_learning_progress(new_experience)
             if goal_space.name == 'agent':
                 agent_exploitations += 1
-                print(f'\n-----AGENT LP UPDATE-----\nNEW LP: {goal_space.learning_progress}\nNEW GOAL DATA:{[goal_space.goal_data[i]['learning_progress'] for i in goal_space.goal_data]}\nAGENT PATH:{[action_to_string(i[18:21]) for i in new_experience.trajectory]}\n')
-                agent_current_LP = round(goal_space.learning_progress,3)
+                if verbose:
+                    print(f'\n-----AGENT LP UPDATE-----\nNEW LP: {goal_space.learning_progress}\nNEW GOAL DATA:{[goal_space.goal_data[i]["learning_progress"] for i in goal_space.goal_data]}\nAGENT PATH:{[action_to_string(i[18:21]) for i in new_experience.trajectory]}\n')
             elif goal_space.name == 'pickaxe':
                 pickaxe_exploitations += 1
-                pickaxe_current_LP = round(goal_space.learning_progress,3)
             elif goal_space.name == 'shovel':
                 shovel_exploitations += 1
-                shovel_current_LP = round(goal_space.learning_progress,3)
             elif goal_space.name == 'cart':
                 cart_exploitations += 1
-                cart_current_LP = round(goal_space.learning_progress,3)
             elif goal_space.name == 'blocks':
                 block_exploitations += 1
-                block_current_LP = round(goal_space.learning_progress,3)
-            
+
+        if (iteration + 1) % config['fitness_window'] == 0:
+            for name, values in window_fitness.items():
+                fitness_curves[name].append(float(np.mean(values)) if values else None)
+                values.clear()
+
+        if budget is not None:
+            budget.enforce(iteration, components)
+
+        memory_report = telemetry.sample(iteration, components) if telemetry is not None else None
+
+        if on_iteration is not None:
+            on_iteration(iteration, components)
+
+        if not verbose:
+            continue
+
         # Print progress
         if iteration % 10 == 0:
+            agent_current_LP, pickaxe_current_LP, shovel_current_LP, cart_current_LP, block_current_LP = [
+                round(gs.learning_progress, 3) for gs in goal_space_manager.goal_spaces.values()]
             print(f"-------Iteration {iteration}-------\nAGENT EXPLOITS: {agent_exploitations} | CURRENT LP: {agent_current_LP}\nPICKAXE EXPLOITS: {pickaxe_exploitations} | CURRENT LP: {pickaxe_current_LP}\nSHOVEL EXPLOITS: {shovel_exploitations} | CURRENT LP: {shovel_current_LP}\nCART EXPLOITS: {cart_exploitations} | CURRENT LP: {cart_current_LP}\nBLOCKS EXPLOITS: {block_exploitations} | CURRENT LP: {block_current_LP}\n")
 
+        if memory_report is not None:
+            print(format_report(memory_report))
+
         if iteration % 100 == 0:
             overall_progress = np.mean([gs.learning_progress for gs in goal_space_manager.goal_spaces.values()])
             print(f"\n\n-------OVERALL LP: {overall_progress:.4f}--------\nFrom {exploitation_count} exploitations and {exploration_count} explorations\nNumber of policies in parameter space: {policy_manager.current_key}\n------------------------------\n\n")
 
+    wall_time = time.perf_counter() - start_time
+    if telemetry is not None:
+        telemetry.stop()
+    stats = {
+        'final_lp': {name: float(gs.learning_progress) for name, gs in goal_space_manager.goal_spaces.items()},
+        'best_fitness': {name: {goal: float(data['best_fitness']) for goal, data in gs.goal_data.items()}
+                         for name, gs in goal_space_manager.goal_spaces.items()},
+        'fitness_curves': fitness_curves,
+        'exploration_count': exploration_count,
+        'exploitation_count': exploitation_count,
+        'num_policies': policy_manager.current_key,
+        'wall_time': wall_time,
+        'iterations_per_sec': config['num_iterations'] / wall_time if wall_time > 0 else 0.0,
+        'steps_per_sec': env_steps / wall_time if wall_time > 0 else 0.0,
+        'memory': telemetry.samples if telemetry is not None else [],
+        'evicted_cells': budget.evicted_cells if budget is not None else 0,
+        'dropped_policies': budget.dropped_policies if budget is not None else 0,
+    }
+    return stats, components
+
+def main():
+    stats, components = run()
+
     # After all iterations, print final statistics
     print("\nFinal Statistics:")
-    for name, goal_space in goal_space_manager.goal_spaces.items():
-        print(f"{name} - Learning Progress: {goal_space.learning_progress:.4f}")
+    for name, learning_progress in stats['final_lp'].items():
+        print(f"{name} - Learning Progress: {learning_progress:.4f}")
 
     # Close the environment
-    env.close()
+    components['env'].close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
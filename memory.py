@@ -0,0 +1,196 @@
+import math
+import sys
+import tracemalloc
+import warnings
+from collections import deque
+import numpy as np
+import torch
+
+# ------ Byte-accurate object sizes ------
+
+# deep_sizeof walks everything reachable from an object and adds up
+# sys.getsizeof for each one, plus the data buffers behind numpy arrays and
+# torch tensors. Objects are counted once, and anything reachable from
+# `exclude` (e.g. goal spaces shared by every experience) is not counted.
+
+def deep_sizeof(obj, exclude=()):
+    seen = set()
+    for shared in exclude:
+        _walk(shared, seen, count=False)
+    return _walk(obj, seen, count=True)
+
+def _walk(obj, seen, count):
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if obj is None or id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, torch.Tensor):
+            storage = obj.untyped_storage()
+            key = ('storage', storage.data_ptr())
+            if key not in seen:
+                seen.add(key)
+                total += storage.nbytes()
+        elif isinstance(obj, np.ndarray):
+            stack.append(obj.base)  # Views only count their header, the base owns the data
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif isinstance(obj, (str, bytes, int, float, bool, np.generic)):
+            pass
+        else:
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for slot in getattr(type(obj), '__slots__', ()):
+                stack.append(getattr(obj, slot, None))
+    return total if count else 0
+
+def parameter_archive_nbytes(policy_manager):
+    return deep_sizeof(policy_manager.parameter_space)
+
+def knowledge_base_nbytes(knowledge_base, goal_space_manager=None, replayer=None):
+    return deep_sizeof(knowledge_base, exclude=[goal_space_manager, replayer])
+
+def goal_data_nbytes(goal_space):
+    return deep_sizeof(goal_space.goal_data)
+
+# ------ Cheap size accounting ------
+
+# Budgets are checked far more often than telemetry reports, so they never
+# walk the archives. Each experience is measured once when it is created or
+# compacted (the knowledge base keeps a running total), and every policy
+# holds the same tensors, so the parameter archive is one policy's size
+# times the number of policies.
+
+def experience_nbytes(experience):
+    # Steps of a full trajectory share one layout, so one step is walked and scaled
+    trajectory = experience._trajectory
+    seen = {id(experience.goal_space), id(experience.replayer), id(trajectory)}
+    total = _walk(experience, seen, count=True)
+    if trajectory:
+        total += sys.getsizeof(trajectory) + len(trajectory) * deep_sizeof(trajectory[0])
+    return total
+
+def estimate_parameter_archive_nbytes(policy_manager):
+    parameter_space = policy_manager.parameter_space
+    if not parameter_space:
+        return sys.getsizeof(parameter_space)
+    return sys.getsizeof(parameter_space) + len(parameter_space) * deep_sizeof(next(iter(parameter_space.values())))
+
+# ------ Telemetry ------
+
+class MemoryTelemetry:
+    def __init__(self, report_every=1000, trace=False):
+        self.report_every = report_every
+        self.trace = trace  # Also sample Python heap usage of the main loop with tracemalloc
+        self.samples = []
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def report(self, components):
+        goal_space_manager = components['goal_space_manager']
+        replayer = components['replayer']
+        report = {
+            'parameter_archive': parameter_archive_nbytes(components['policy_manager']),
+            'knowledge_base': knowledge_base_nbytes(components['knowledge_base'], goal_space_manager, replayer),
+            'goal_data': {name: goal_data_nbytes(gs) for name, gs in goal_space_manager.goal_spaces.items()},
+            'replay_cache': deep_sizeof(replayer.cache) if replayer is not None else 0,
+            'num_policies': len(components['policy_manager'].parameter_space),
+            'num_experiences': len(components['knowledge_base']),
+        }
+        if self.trace:
+            report['traced_current'], report['traced_peak'] = tracemalloc.get_traced_memory()
+        return report
+
+    def sample(self, iteration, components):
+        if iteration % self.report_every:
+            return None
+        report = {'iteration': iteration, **self.report(components)}
+        self.samples.append(report)
+        return report
+
+    def stop(self):
+        if self.trace:
+            tracemalloc.stop()
+
+def format_report(report):
+    mb = lambda nbytes: f"{nbytes / 2**20:.2f} MB"
+    goal_data = sum(report['goal_data'].values())
+    line = (f"MEMORY | policies: {report['num_policies']} ({mb(report['parameter_archive'])}) | "
+            f"experiences: {report['num_experiences']} ({mb(report['knowledge_base'])}) | "
+            f"goal data: {mb(goal_data)} | replay cache: {mb(report['replay_cache'])}")
+    if 'traced_current' in report:
+        line += f" | traced: {mb(report['traced_current'])} (peak {mb(report['traced_peak'])})"
+    return line
+
+# ------ Hard budgets ------
+
+# When a budget is exceeded, the cheap lossless fixes run first: unreferenced
+# policies are dropped and full trajectories are compacted to action-only
+# storage. Only then are the least useful archive cells evicted until under budget.
+# Budgets hold after every check, so with check_every=1 an archive is only
+# ever over budget by what a single rollout adds. Sizes are the estimates
+# above, not process memory. A budget too small to meet with one cell left
+# raises a warning and the run carries on over budget.
+
+class MemoryBudget:
+    def __init__(self, parameter_archive_bytes=None, knowledge_base_bytes=None, check_every=1):
+        self.parameter_archive_bytes = parameter_archive_bytes
+        self.knowledge_base_bytes = knowledge_base_bytes
+        self.check_every = check_every
+        self.evicted_cells = 0
+        self.dropped_policies = 0
+        self.unmet = set()  # Budgets already warned about
+
+    def enforce(self, iteration, components):
+        if iteration % self.check_every:
+            return
+        knowledge_base = components['knowledge_base']
+        policy_manager = components['policy_manager']
+
+        if self.knowledge_base_bytes is not None:
+            if knowledge_base.nbytes > self.knowledge_base_bytes and components['replayer'] is not None:
+                knowledge_base.compact(components['replayer'])
+            self._evict_until(knowledge_base, knowledge_base.nbytes, self.knowledge_base_bytes,
+                              lambda: knowledge_base.nbytes, 'knowledge_base')
+
+        if self.parameter_archive_bytes is not None:
+            size = estimate_parameter_archive_nbytes(policy_manager)
+            if size > self.parameter_archive_bytes:
+                self.dropped_policies += compact_parameter_archive(policy_manager, knowledge_base)
+                size = estimate_parameter_archive_nbytes(policy_manager)
+
+            def measure_archive():
+                self.dropped_policies += compact_parameter_archive(policy_manager, knowledge_base)
+                return estimate_parameter_archive_nbytes(policy_manager)
+            self._evict_until(knowledge_base, size, self.parameter_archive_bytes, measure_archive, 'parameter_archive')
+
+    def _evict_until(self, knowledge_base, size, budget, measure, name):
+        while size > budget and len(knowledge_base.cells) > 1:
+            # Evict roughly the share of cells that accounts for the excess, then re-measure
+            cells = len(knowledge_base.cells)
+            to_evict = min(cells - 1, max(1, math.ceil(cells * (size - budget) / size)))
+            knowledge_base.evict_lowest_cells(to_evict)
+            self.evicted_cells += to_evict
+            size = measure()
+        if size > budget and name not in self.unmet:
+            self.unmet.add(name)
+            warnings.warn(f"{name} budget of {budget} bytes cannot be met: {size} bytes with a single cell left",
+                          RuntimeWarning)
+
+def compact_parameter_archive(policy_manager, knowledge_base):
+    # Parameters are only ever looked up through the keys stored in knowledge
+    # base trajectories, so any other key can go. Key 1 (initial parameters) stays.
+    referenced = {1}
+    for experience in knowledge_base.experiences:
+        referenced.update(experience.get_param_keys())
+    unreferenced = [key for key in policy_manager.parameter_space if key not in referenced]
+    for key in unreferenced:
+        del policy_manager.parameter_space[key]
+    return len(unreferenced)
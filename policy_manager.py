@@ -3,19 +3,31 @@ import torch
 import random
 
 class PolicyManager:
-    def __init__(self, neural_network):
+    def __init__(self, neural_network, mutation_strength=0.3, exploration_rate=0.1, mask_invalid_actions=False):
         self.nn = neural_network
+        self.mutation_strength = mutation_strength
+        self.mask_invalid_actions = mask_invalid_actions  # Never sample actions the env reports as no-ops
         self.parameter_space = {1: self.nn.get_parameters()}
         self.current_key = 1
         self.exploration_policy = ExplorationPolicy(self)
-        self.exploitation_policy = ExploitationPolicy(self)
+        self.exploitation_policy = ExploitationPolicy(self, exploration_rate)
         self.last_action = None  # To keep track of the last action
         self.repeated_tool_use_count = 0
 
-    def select_action(self, observation):
+    def action_mask(self, env):
+        return env.valid_action_mask() if self.mask_invalid_actions else None
+
+    def select_action(self, observation, valid_mask=None):
         with torch.no_grad():
             input_tensor = torch.tensor(observation, dtype=torch.float32)
             action_probs = self.nn(input_tensor)
+
+            # Zero out no-op actions (walls, diamond blocks, useless tool use) unless nothing is left
+            if valid_mask is not None and valid_mask.any():
+                valid = torch.as_tensor(valid_mask, dtype=torch.float32)
+                action_probs = action_probs * valid
+                if torch.sum(action_probs) == 0:
+                    action_probs = valid  # Softmax underflowed on every valid action, pick uniformly
             
             if self.last_action is not None and np.array_equal(self.last_action, [0, 0, 1]):
                 self.repeated_tool_use_count += 1 
@@ -25,8 +37,9 @@ class PolicyManager:
                 self.repeated_tool_use_count = 0
                 action_probs[4] = 0  # Set probability of "use tool" to 0
                 if torch.sum(action_probs) == 0:
-                    # If all probabilities are zero, choose randomly from other actions
-                    action_index = random.randint(0, 3)
+                    # If all probabilities are zero, choose randomly from the other valid actions
+                    valid_moves = [i for i in range(4) if valid_mask is None or valid_mask[i]]
+                    action_index = random.choice(valid_moves) if valid_moves else random.randint(0, 3)
                 else:
                     action_probs = action_probs / torch.sum(action_probs)  # Renormalize
                     action_index = torch.multinomial(action_probs, 1).item()
@@ -60,7 +73,7 @@ class PolicyManager:
         original_params = self.parameter_space[trajectory[start_index][-1]]
         mutated_params = {name: param.clone() for name, param in original_params.items()}
         for param in mutated_params.values():
-            noise = torch.randn_like(param) * 0.3
+            noise = torch.randn_like(param) * self.mutation_strength
             param.add_(noise)
         
         # Add the new mutated parameters to the parameter space with a new key
@@ -100,7 +113,7 @@ class ExplorationPolicy:
             # Use mutated parameters from mutation_start onwards
             for a in range(mutation_start, 40):
                 self.policy_manager.nn.set_parameters(self.policy_manager.parameter_space[param_keys[a]])
-                action = self.policy_manager.select_action(observation)
+                action = self.policy_manager.select_action(observation, self.policy_manager.action_mask(env))
                 next_observation, done = env.step(action[0], action[1], action[2])
                 trajectory.append(tuple(observation) + tuple(action) + (param_keys[a],))
                 observation = next_observation
@@ -109,7 +122,7 @@ class ExplorationPolicy:
         else:
             # If no relevant experience, use initial parameters for all steps
             for a in range(40):
-                action = self.policy_manager.select_action(observation)
+                action = self.policy_manager.select_action(observation, self.policy_manager.action_mask(env))
                 next_observation, done = env.step(action[0], action[1], action[2])
                 trajectory.append(tuple(observation) + tuple(action) + (1,))
                 observation = next_observation
@@ -128,12 +141,12 @@ class ExplorationPolicy:
                 mutation_start = i + 1  # Start mutating from the next step
             elif fitness < best_fitness:
                 break  # Stop when fitness starts decreasing
-        return mutation_start
+        return min(mutation_start, len(experience.trajectory) - 1)  # Always mutate at least the last step
 
 class ExploitationPolicy:
-    def __init__(self, policy_manager):
+    def __init__(self, policy_manager, exploration_rate=0.1):
         self.policy_manager = policy_manager
-        self.exploration_rate = 0.1  # Small chance to explore during exploitation
+        self.exploration_rate = exploration_rate  # Small chance to explore during exploitation
 
     def execute(self, env, goal_space, goal, relevant_experience):
         self.repeated_tool_use_count = 0
@@ -146,7 +159,7 @@ class ExploitationPolicy:
                 if random.random() < self.exploration_rate:
                     # Small chance to explore
                     self.policy_manager.nn.set_parameters(self.policy_manager.parameter_space[step[-1]])
-                    action = self.policy_manager.select_action(observation)
+                    action = self.policy_manager.select_action(observation, self.policy_manager.action_mask(env))
                 else:
                     # Otherwise, use the action from the best trajectory
                     action = step[18:21]
@@ -159,7 +172,7 @@ class ExploitationPolicy:
         else:
             # If just run on current params (should only be for when exploit is picked first)
             for _ in range(40):
-                action = self.policy_manager.select_action(observation)
+                action = self.policy_manager.select_action(observation, self.policy_manager.action_mask(env))
                 next_observation, done = env.step(action[0], action[1], action[2])
                 trajectory.append(tuple(observation) + tuple(action) + (1,))  # Assuming 1 is the key for initial parameters
                 observation = next_observation
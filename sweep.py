@@ -0,0 +1,97 @@
+import csv
+import itertools
+import json
+import multiprocessing as mp
+import torch
+from env import compile_map
+from main import run
+from utils import fresh_seed
+
+# Grid of settings to sweep. Every combination is run once per seed; any key
+# of main.DEFAULT_CONFIG can appear here.
+SWEEP_GRID = {
+    'num_iterations': [2000],
+    'explore_prob': [0.7, 0.8, 0.9],
+    'mutation_strength': [0.1, 0.3],
+    'kb_max_size': [10000],
+    'exploit_exploration_rate': [0.1],
+    'lp_choice_prob': [0.8],
+}
+SEEDS = [0]
+NUM_PROCESSES = None  # None uses every core on the box
+RESULTS_PATH = "sweep_results.csv"
+
+# ------ Grid expansion ------
+
+def expand_grid(grid, seeds=(None,)):
+    keys = list(grid)
+    configs = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        for seed in seeds:
+            configs.append({**dict(zip(keys, values)), 'seed': seed})
+    return configs
+
+# ------ Worker process ------
+
+# The compiled map is handed to each worker once through the pool
+# initializer rather than being re-read from disk for every config. Shared
+# with the island model, whose workers are set up the same way.
+_worker_tiles = None
+
+def init_worker(tiles):
+    global _worker_tiles
+    _worker_tiles = tiles
+    torch.set_num_threads(1)  # One process per core, so no intra-op threading
+
+def worker_tiles():
+    return _worker_tiles
+
+def worker_seed(seed, offset=0):
+    # Forked workers inherit the parent's RNG state, so every run gets an
+    # explicit seed: the given one, or fresh entropy when it is None
+    return ((fresh_seed() if seed is None else seed) + offset) % 2**32
+
+def run_config(config):
+    config = {**config, 'seed': worker_seed(config.get('seed'))}  # Recorded in the results row
+    stats, _ = run({**config, 'headless': True}, tiles=_worker_tiles, verbose=False)
+    row = dict(config)
+    for name, learning_progress in stats['final_lp'].items():
+        row[f'lp_{name}'] = learning_progress
+    row['num_policies'] = stats['num_policies']
+    row['wall_time'] = stats['wall_time']
+    row['iterations_per_sec'] = stats['iterations_per_sec']
+    row['steps_per_sec'] = stats['steps_per_sec']
+    row['fitness_curves'] = stats['fitness_curves']
+    return row
+
+# ------ Sweep driver ------
+
+def run_sweep(grid=SWEEP_GRID, seeds=SEEDS, processes=NUM_PROCESSES):
+    configs = expand_grid(grid, seeds)
+    tiles = compile_map()
+    with mp.Pool(processes, initializer=init_worker, initargs=(tiles,)) as pool:
+        return pool.map(run_config, configs, chunksize=1)
+
+def write_results(rows, path=RESULTS_PATH):
+    if not rows:
+        return
+    fieldnames = list(rows[0])
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'fitness_curves': json.dumps(row['fitness_curves'])})
+
+def main():
+    rows = run_sweep()
+    write_results(rows)
+
+    print(f"\n{'config':<60} | {'mean LP':>8} | {'it/s':>8}")
+    for row in rows:
+        config = ', '.join(f'{key}={row[key]}' for key in SWEEP_GRID if len(SWEEP_GRID[key]) > 1)
+        mean_lp = sum(row[f'lp_{name}'] for name in ('agent', 'pickaxe', 'shovel', 'cart', 'blocks')) / 5
+        print(f"{config:<60} | {mean_lp:>8.4f} | {row['iterations_per_sec']:>8.1f}")
+    print(f"\nResults written to {RESULTS_PATH}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import hashlib
+import os
+import tempfile
+from collections import deque
+import numpy as np
+from env import MinecraftCartEnv, compile_map
+from utils import ACTIONS, action_to_index
+
+CACHE_DIR = "transition_cache"
+CACHE_VERSION = 2
+
+# ------ Compiled transition model ------
+
+# The dynamic state of MinecraftCartEnv is tiny (agent tile, held tool, cart
+# tile and stuck flag, water trap flag, diamond mask), so every reachable
+# state can be enumerated once per map. Each state gets an integer index and
+# the dynamics collapse into lookup tables:
+#   next_state[s, a]     state reached by taking action a in state s
+#   reset_state[s]       state the next episode starts from (diamonds persist)
+#   observation_index[s] row of `observations` returned in state s
+#   valid_actions[s, a]  False where action a would be a no-op in state s
+# A step is then one array gather, and a batch of envs is fancy indexing.
+
+class TransitionModel:
+    def __init__(self, states, next_state, reset_state, observation_index, observations, valid_actions):
+        self.states = states
+        self.next_state = next_state
+        self.reset_state = reset_state
+        self.observation_index = observation_index
+        self.observations = observations
+        self.valid_actions = valid_actions
+        self.state_index = {state: i for i, state in enumerate(states)}
+        self.start_state = 0  # BFS starts from the initial game state
+
+    @classmethod
+    def build(cls, tiles=None):
+        env = MinecraftCartEnv(tiles=tiles, headless=True)
+        start = env.get_state()
+        states = [start]
+        state_index = {start: 0}
+        next_rows = []
+        reset_state = []
+        observations = []
+        valid_actions = []
+        queue = deque([start])
+
+        def index_of(state):
+            if state not in state_index:
+                state_index[state] = len(states)
+                states.append(state)
+                queue.append(state)
+            return state_index[state]
+
+        while queue:
+            state = queue.popleft()
+
+            env.set_state(state)
+            observations.append(env.observation())
+            valid_actions.append(env.valid_action_mask())
+
+            row = []
+            for action in ACTIONS:
+                env.set_state(state)
+                env.stepCount = 0  # Keep the reference env from resetting mid-enumeration
+                env.step(*action, render=False)
+                row.append(index_of(env.get_state()))
+            next_rows.append(row)
+
+            env.set_state(state)
+            env.set_game()
+            reset_state.append(index_of(env.get_state()))
+
+        dtype = np.int16 if len(states) <= np.iinfo(np.int16).max else np.int32
+        unique_observations, observation_index = np.unique(np.array(observations), axis=0, return_inverse=True)
+        return cls(states,
+                   np.array(next_rows, dtype=dtype),
+                   np.array(reset_state, dtype=dtype),
+                   observation_index.reshape(-1).astype(dtype),
+                   unique_observations.astype(np.float32),
+                   np.array(valid_actions, dtype=bool))
+
+    # Utilities for caching the tables on disk, keyed by the compiled map
+
+    @staticmethod
+    def cache_path(tiles, cache_dir=CACHE_DIR):
+        digest = hashlib.sha1(repr((CACHE_VERSION, sorted(tiles.items()))).encode()).hexdigest()[:16]
+        return os.path.join(cache_dir, f"transitions_{digest}.npz")
+
+    @classmethod
+    def load_or_build(cls, tiles=None, cache_dir=CACHE_DIR):
+        tiles = tiles if tiles is not None else compile_map()
+        path = cls.cache_path(tiles, cache_dir)
+        if os.path.exists(path):
+            return cls.load(path)
+        model = cls.build(tiles)
+        model.verify(tiles)  # Checked against the pygame env once, before anything is cached
+        model.save(path)
+        return model
+
+    def save(self, path):
+        # Sweep workers and islands may build the same cache at once, so each
+        # writes a private temp file and atomically moves it into place
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f,
+                                    states=self.encode_states(self.states),
+                                    next_state=self.next_state,
+                                    reset_state=self.reset_state,
+                                    observation_index=self.observation_index,
+                                    observations=self.observations,
+                                    valid_actions=self.valid_actions)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(cls.decode_states(data['states']),
+                       data['next_state'],
+                       data['reset_state'],
+                       data['observation_index'],
+                       data['observations'],
+                       data['valid_actions'])
+
+    # States are stored as int rows: agent x, y, held tool, cart x, y, stuck, water, diamond bits
+
+    @staticmethod
+    def encode_states(states):
+        return np.array([[*agentPos, heldTool, *cartPos, cartStuck, waterTrapped, *diamondMask]
+                         for agentPos, heldTool, cartPos, cartStuck, waterTrapped, diamondMask in states],
+                        dtype=np.int16)
+
+    @staticmethod
+    def decode_states(rows):
+        return [((int(row[0]), int(row[1])), int(row[2]), (int(row[3]), int(row[4])),
+                 bool(row[5]), bool(row[6]), tuple(int(bit) for bit in row[7:]))
+                for row in rows]
+
+    # Utilities for stepping one or many states
+
+    def step(self, state, action_index):
+        next_state = self.next_state[state, action_index]
+        return next_state, self.observations[self.observation_index[next_state]]
+
+    def step_batch(self, states, action_indices):
+        next_states = self.next_state[states, action_indices]
+        return next_states, self.observations[self.observation_index[next_states]]
+
+    # Utility for checking every table entry against the reference env
+
+    def verify(self, tiles=None):
+        env = MinecraftCartEnv(tiles=tiles, headless=True)
+        for s, state in enumerate(self.states):
+            env.set_state(state)
+            assert np.array_equal(env.observation(), self.observations[self.observation_index[s]]), \
+                f"observation mismatch in state {state}"
+            assert np.array_equal(env.valid_action_mask(), self.valid_actions[s]), f"action mask mismatch in state {state}"
+            for a, action in enumerate(ACTIONS):
+                env.set_state(state)
+                env.stepCount = 0
+                observation, _ = env.step(*action, render=False)
+                next_state = self.next_state[s, a]
+                assert env.get_state() == self.states[next_state], \
+                    f"next state mismatch for state {state}, action {action}"
+                assert np.array_equal(observation, self.observations[self.observation_index[next_state]]), \
+                    f"observation mismatch for state {state}, action {action}"
+            env.set_state(state)
+            env.set_game()
+            assert env.get_state() == self.states[self.reset_state[s]], f"reset mismatch in state {state}"
+        return True
+
+# ------ Drop-in env backed by the transition tables ------
+
+class CompiledCartEnv:
+    def __init__(self, model):
+        self.model = model
+        self.maxSteps = 40  # 40 step rollout as in paper
+        self.headless = True
+        self.state = model.start_state
+        self.stepCount = 0
+
+    def step(self, move, strafe, use, render=True):
+        self.state = self.model.next_state[self.state, action_to_index((move, strafe, use))]
+        observation = self.observation()
+        done = self.stepCount + 1 >= self.maxSteps
+        self.stepCount += 1
+        if done:
+            self.set_game()
+        return observation, done
+
+    def observation(self):
+        return self.model.observations[self.model.observation_index[self.state]].copy()
+
+    def valid_action_mask(self):
+        return self.model.valid_actions[self.state].copy()
+
+    def set_game(self):
+        self.state = self.model.reset_state[self.state]
+        self.stepCount = 0
+
+    def get_state(self):
+        return self.model.states[self.state]
+
+    def set_state(self, state):
+        self.state = self.model.state_index[state]
+
+    def close(self):
+        pass
+
+# ------ Many envs stepped in lockstep with fancy indexing ------
+
+class BatchedCartEnv:
+    def __init__(self, model, num_envs):
+        self.model = model
+        self.maxSteps = 40
+        self.states = np.full(num_envs, model.start_state, dtype=np.int64)
+        self.stepCounts = np.zeros(num_envs, dtype=np.int64)
+
+    def observation(self):
+        return self.model.observations[self.model.observation_index[self.states]]
+
+    def valid_action_mask(self):
+        return self.model.valid_actions[self.states]
+
+    def step(self, action_indices):
+        self.states, observations = self.model.step_batch(self.states, action_indices)
+        self.stepCounts += 1
+        dones = self.stepCounts >= self.maxSteps
+        self.states[dones] = self.model.reset_state[self.states[dones]]
+        self.stepCounts[dones] = 0
+        return observations, dones
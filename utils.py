@@ -1,3 +1,4 @@
+import os
 import numpy as np
 
 def action_to_string(action):
@@ -12,4 +13,17 @@ def action_to_string(action):
     elif np.array_equal(action, [0, 0, 1]):
         return "use"
     else:
-        return "unknown"
\ No newline at end of file
+        return "unknown"
+
+# Discrete action set in the order used by the policy network outputs:
+# forward, backward, left, right, use
+ACTIONS = [(-1, 0, 0), (1, 0, 0), (0, -1, 0), (0, 1, 0), (0, 0, 1)]
+ACTION_INDEX = {action: i for i, action in enumerate(ACTIONS)}
+
+def action_to_index(action):
+    return ACTION_INDEX[(int(action[0]), int(action[1]), int(action[2]))]
+
+# Fresh OS entropy, for processes that must not share the RNG state they
+# inherited from a forked parent. Kept below 2**32 for np.random.seed.
+def fresh_seed():
+    return int.from_bytes(os.urandom(4), 'little')